@@ -149,6 +149,8 @@ class Pipeline(BaseModel):
             return total_vectors_stored
         except Exception as e:
             raise e
+        finally:
+            self.sink.close()
     
     def search(self, query:str, number_of_results:int) -> List[NeumSearchResult]:
         vector_for_query = self.embed.embed_query(query=query)
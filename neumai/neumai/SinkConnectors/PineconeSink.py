@@ -1,7 +1,8 @@
-from typing import List, Optional
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
 from neumai.Shared.NeumSearch import NeumSearchResult
 from neumai.Shared.NeumSinkInfo import NeumSinkInfo
 from neumai.SinkConnectors.SinkConnector import SinkConnector
+from neumai.SinkConnectors.SinkHelper import batched, upsert_concurrently
 from neumai.Shared.NeumVector  import NeumVector
 from neumai.Shared.Exceptions import (
     PineconeConnectionException,
@@ -9,8 +10,57 @@ from neumai.Shared.Exceptions import (
     PineconeIndexInfoException,
     PineconeQueryException,
 )
-from pydantic import Field
+from pydantic import Field, PrivateAttr, confloat, conint
+import numpy as np
+import orjson
+import threading
+import time
 import pinecone
+import urllib3
+from pinecone.exceptions import PineconeException, PineconeProtocolError
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+
+try:
+    from google.protobuf.struct_pb2 import Struct
+    from pinecone.core.grpc.protos.vector_service_pb2 import Vector as GRPCVector
+except ImportError:
+    # Only available when pinecone-client is installed with the grpc extra
+    GRPCVector = None
+
+# Pinecone rejects upsert requests above 2MB, leave some headroom for the envelope.
+MAX_UPSERT_REQUEST_BYTES = 1_800_000
+
+# pinecone.init configures the client for the whole process and is not thread safe.
+_INIT_LOCK = threading.Lock()
+_initialized_with: Optional[Tuple[str, str]] = None
+
+def _ensure_init(api_key:str, environment:str) -> None:
+    """Run pinecone.init only when the credentials differ from the last call. Hold _INIT_LOCK until the index handle is built, as handles copy the configuration"""
+    global _initialized_with
+    if _initialized_with != (api_key, environment):
+        pinecone.init(api_key=api_key, environment=environment)
+        _initialized_with = (api_key, environment)
+
+RETRYABLE_HTTP_STATUSES = {429, 500, 502, 503, 504}
+RETRYABLE_GRPC_CODES = {"UNAVAILABLE", "RESOURCE_EXHAUSTED", "DEADLINE_EXCEEDED"}
+
+def is_retryable_upsert_error(exception:BaseException) -> bool:
+    """Rate limits, server errors and dropped connections are worth retrying, anything else is not"""
+    # The REST client raises PineconeProtocolError when the connection drops mid request
+    if isinstance(exception, PineconeProtocolError):
+        return True
+    # The gRPC client re-raises every RpcError as a plain PineconeException from the original error
+    if isinstance(exception, PineconeException) and exception.__cause__ is not None:
+        exception = exception.__cause__
+    # REST client errors carry the http status
+    status = getattr(exception, "status", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_HTTP_STATUSES
+    # grpc.RpcError exposes the status code through code()
+    code = getattr(exception, "code", None)
+    if callable(code):
+        return getattr(code(), "name", None) in RETRYABLE_GRPC_CODES
+    return isinstance(exception, (ConnectionError, TimeoutError, urllib3.exceptions.HTTPError))
 
 class  PineconeSink(SinkConnector):
     """
@@ -31,6 +81,18 @@ class  PineconeSink(SinkConnector):
 
     namespace : Optional[str]
         Optional namespace within the Pinecone environment. Used for organizing data.
+
+    batch_size : int
+        Optional maximum number of vectors sent in each upsert request. Batches are split further to stay under Pinecone's 2MB request limit. Default is 100.
+
+    concurrency : int
+        Optional number of upsert requests kept in flight at the same time. Default is 8.
+
+    use_grpc : Optional[bool]
+        Optional flag to talk to the index over gRPC, which has lower latency than REST. gRPC is opt-in: it needs pinecone-client installed with the grpc extra (pip install "pinecone-client[grpc]==2.2.2"), otherwise the REST client is used. Default is True.
+
+    stats_ttl_seconds : float
+        Optional number of seconds index stats are reused by info before being fetched again, 0 disables caching. Default is 5.
     """
 
     api_key: str = Field(..., description="API key for Pinecone.")
@@ -41,6 +103,18 @@ class  PineconeSink(SinkConnector):
 
     namespace: Optional[str] = Field(None, description="Optional namespace.")
 
+    batch_size: conint(gt=0) = Field(100, description="Optional upsert batch size.")
+
+    concurrency: conint(gt=0) = Field(8, description="Optional number of concurrent upsert requests.")
+
+    use_grpc: Optional[bool] = Field(True, description="Optional flag to use the gRPC client.")
+
+    stats_ttl_seconds: confloat(ge=0) = Field(5.0, description="Optional time to live for cached index stats.")
+
+    _idx: Optional[Any] = PrivateAttr(default=None)
+
+    _stats_cache: Optional[Tuple[float, dict]] = PrivateAttr(default=None)
+
     @property
     def sink_name(self) -> str:
         return 'PineconeSink'
@@ -51,80 +125,128 @@ class  PineconeSink(SinkConnector):
 
     @property
     def optional_properties(self) -> List[str]:
-        return ['namespace']
+        return ['namespace', 'batch_size', 'concurrency', 'use_grpc', 'stats_ttl_seconds']
+
+    @property
+    def _index(self) -> Any:
+        """Index handle, initialized on first use and reused across calls"""
+        if self._idx is None:
+            with _INIT_LOCK:
+                # Another thread may have built the handle while this one waited for the lock
+                if self._idx is None:
+                    _ensure_init(self.api_key, self.environment)
+                    # pinecone only exports GRPCIndex when installed with the grpc extra
+                    if self.use_grpc and hasattr(pinecone, "GRPCIndex"):
+                        self._idx = pinecone.GRPCIndex(self.index)
+                    else:
+                        self._idx = pinecone.Index(index_name=self.index)
+        return self._idx
+
+    def close(self) -> None:
+        """Close and drop the cached index handle, e.g. after rotating credentials"""
+        # GRPCIndex holds a gRPC channel and the REST index a thread pool, both expose close()
+        if hasattr(self._idx, "close"):
+            self._idx.close()
+        self._idx = None
+        self._stats_cache = None
 
     def validation(self) -> bool:
         """config_validation connector setup"""
-        import pinecone
         try:
-            pinecone.init(api_key=self.api_key, environment=self.environment)    
-            index = pinecone.Index(index_name=self.index)
+            with _INIT_LOCK:
+                _ensure_init(self.api_key, self.environment)
+                index = pinecone.Index(index_name=self.index)
             index.describe_index_stats()
         except Exception as e:
             raise PineconeConnectionException(f"Pinecone connection couldn't be initialized. See exception: {e}")
         return True 
 
-    def store(self, pipeline_id: str, vectors_to_store:List[NeumVector], task_id:str = "") -> int:
-        api_key =  self.api_key
-        environment = self.environment
-        index = self.index
+    def store(self, pipeline_id: str, vectors_to_store:Iterable[NeumVector], task_id:str = "") -> int:
         namespace = self.namespace
         if namespace == None: namespace = f"pipeline_{pipeline_id}"
 
         try:
-            pinecone.init(api_key=api_key, environment=environment)    
-            index = pinecone.Index(index_name=index)
-            batch_size = 32 # how does changing this affect ?
-            vectors_stored = 0
-            for i in range(0, len(vectors_to_store), batch_size):
-                # set end position of batch
-                i_end = min(i + batch_size, len(vectors_to_store))
-                # get batch of texts and ids
-                vector_batch = vectors_to_store[i:i_end]
-                to_upsert = [(vector.id, vector.vector, vector.metadata) for vector in vector_batch]
-                result = index.upsert(vectors=to_upsert, namespace=namespace)
-                vectors_stored += result['upserted_count'] 
+            index = self._index
+            vectors_stored = self._upsert(index=index, vectors_to_store=vectors_to_store, namespace=namespace)
+            self._stats_cache = None
+        except PineconeInsertionException:
+            raise
         except Exception as e:
             raise PineconeInsertionException(f"Failed to store in Pinecone. Exception - {e}")
         return int(vectors_stored)
+
+    def _upsert(self, index:Any, vectors_to_store:Iterable[NeumVector], namespace:str) -> int:
+        # The pinecone client only exposes blocking calls, so batches are upserted from threads.
+        as_grpc = hasattr(pinecone, "GRPCIndex") and isinstance(index, pinecone.GRPCIndex)
+        return upsert_concurrently(
+            self._upsert_batches(vectors_to_store, as_grpc=as_grpc),
+            upsert=lambda batch: self._upsert_batch(index, batch, namespace),
+            count=lambda response: response.upserted_count,
+            concurrency=self.concurrency,
+            failed=lambda vectors_stored, e: PineconeInsertionException(f"Failed to store in Pinecone after {vectors_stored} vectors were stored. Exception - {e}"),
+        )
+
+    @retry(retry=retry_if_exception(is_retryable_upsert_error), wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(5), reraise=True)
+    def _upsert_batch(self, index:Any, to_upsert:list, namespace:str) -> Any:
+        return index.upsert(vectors=to_upsert, namespace=namespace)
+
+    def _upsert_batches(self, vectors_to_store:Iterable[NeumVector], as_grpc:bool = False) -> Iterator[list]:
+        # Estimates the request size from the values as each transport encodes them plus the json metadata.
+        # Records are built once here, so a batch that is sent again is not re-encoded.
+        for vector_batch in batched(vectors_to_store, self.batch_size):
+            to_upsert = []
+            request_bytes = 0
+            for vector in vector_batch:
+                # Both clients serialize python floats, numpy rows are converted in one C-level call
+                values = vector.vector.tolist() if isinstance(vector.vector, np.ndarray) else vector.vector
+                # gRPC packs each value as a 4 byte float, REST sends them as json text
+                values_bytes = len(values) * 4 if as_grpc else len(orjson.dumps(values))
+                record_bytes = values_bytes + len(orjson.dumps(vector.metadata, option=orjson.OPT_NON_STR_KEYS))
+                if to_upsert and request_bytes + record_bytes > MAX_UPSERT_REQUEST_BYTES:
+                    yield to_upsert
+                    to_upsert = []
+                    request_bytes = 0
+                to_upsert.append(self._grpc_vector(vector, values) if as_grpc else (vector.id, values, vector.metadata))
+                request_bytes += record_bytes
+            yield to_upsert
+
+    def _grpc_vector(self, vector:NeumVector, values:List[float]) -> "GRPCVector":
+        """Protobuf vector message, so the gRPC client does not rebuild it on every send"""
+        metadata = Struct()
+        if vector.metadata:
+            metadata.update(vector.metadata)
+        return GRPCVector(id=vector.id, values=values, metadata=metadata)
     
     def search(self, vector: List[float], number_of_results:int, pipeline_id:str) -> List[NeumSearchResult]:
-        import pinecone
-        api_key =  self.api_key
-        environment = self.environment
-        index = self.index
         namespace = self.namespace
         if namespace == None: namespace = f"pipeline_{pipeline_id}"
 
         try:
-            pinecone.init(      
-                api_key=api_key,      
-                environment=environment)    
-            index = pinecone.Index(index)
+            index = self._index
             results = index.query(vector=vector, top_k=number_of_results, namespace=namespace, include_values=False, include_metadata=True)["matches"]
         except Exception as e:
             raise PineconeQueryException(f"Failed to query pinecone. Exception - {e}")
         
-        matches = []
-        for result in results:
-            matches.append(NeumSearchResult(id= result["id"], metadata=result["metadata"], score=result["score"]))
-        return matches
+        search_result = NeumSearchResult
+        return [search_result(id=result["id"], metadata=result["metadata"], score=result["score"]) for result in results]
     
     def info(self, pipeline_id: str) -> NeumSinkInfo:
-        import pinecone
-        api_key =  self.api_key
-        environment = self.environment
-        index = self.index
         namespace = self.namespace
         if namespace == None: namespace = f"pipeline_{pipeline_id}"
         
         try:
-            pinecone.init(      
-                api_key=api_key,      
-                environment=environment)    
-            index = pinecone.Index(index)
-            namespaces = index.describe_index_stats()["namespace"]
+            namespaces = self._namespace_stats()
             if namespace in namespaces:
                 return NeumSinkInfo(number_vectors_stored=namespaces[namespace]["vector_count"])
         except Exception as e:
-            raise PineconeIndexInfoException(f"Failed to get info for pinecone. Exception - {e}")
\ No newline at end of file
+            raise PineconeIndexInfoException(f"Failed to get info for pinecone. Exception - {e}")
+
+    def _namespace_stats(self) -> dict:
+        """Per namespace index stats, reused for stats_ttl_seconds so polling info does not hit Pinecone every time"""
+        if self._stats_cache is not None:
+            fetched_at, namespaces = self._stats_cache
+            if time.monotonic() - fetched_at < self.stats_ttl_seconds:
+                return namespaces
+        namespaces = self._index.describe_index_stats()["namespaces"]
+        self._stats_cache = (time.monotonic(), namespaces)
+        return namespaces
\ No newline at end of file
@@ -2,7 +2,7 @@ from neumai.Shared.NeumSearch import NeumSearchResult
 from neumai.Shared.NeumVector import NeumVector
 from neumai.Shared.NeumSinkInfo import NeumSinkInfo
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Iterable, List
 from pydantic import BaseModel
 import json
 
@@ -28,7 +28,7 @@ class SinkConnector(ABC, BaseModel):
         """config_validation sink setup"""
 
     @abstractmethod
-    def store(self, pipeline_id: str, vectors_to_store:List[NeumVector], task_id:str = "") -> int:
+    def store(self, pipeline_id: str, vectors_to_store:Iterable[NeumVector], task_id:str = "") -> int:
         """Store vectors with a given service"""
 
     @abstractmethod
@@ -39,6 +39,9 @@ class SinkConnector(ABC, BaseModel):
     def info(self, pipeline_id:str) -> NeumSinkInfo:
         """Get information about what is stores in the sink"""
 
+    def close(self) -> None:
+        """Release any client the sink keeps open between calls"""
+
     def as_json(self):
         """Python does not have built in serialization. We need this logic to be able to respond in our API..
 
@@ -0,0 +1,43 @@
+from typing import Callable, Iterable, Iterator, Tuple, TypeVar
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import itertools
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+def batched(iterable:Iterable[T], batch_size:int) -> Iterator[Tuple[T, ...]]:
+    """Backport of itertools.batched (python 3.12+): yields tuples of up to batch_size items"""
+    iterator = iter(iterable)
+    while batch := tuple(itertools.islice(iterator, batch_size)):
+        yield batch
+
+def upsert_concurrently(batches:Iterable[T], upsert:Callable[[T], R], count:Callable[[R], int], concurrency:int, failed:Callable[[int, Exception], Exception]) -> int:
+    """Upsert batches from a pool of concurrency threads and return the number of vectors stored, summed with count over the upsert results. If an upsert fails, raises the exception built by failed from the number of vectors stored and the error"""
+    # At most `concurrency` batches are pending, so the input is consumed as
+    # upserts complete rather than read into memory up front.
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        finished = []
+        try:
+            for batch in batches:
+                if len(pending) >= concurrency:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    finished.extend(done)
+                    for future in done:
+                        future.result()
+                pending.add(executor.submit(upsert, batch))
+            done, pending = wait(pending)
+            finished.extend(done)
+            for future in done:
+                future.result()
+        except Exception as e:
+            # Batches that have not started are dropped, the ones already running are counted once they finish
+            for future in pending:
+                future.cancel()
+            finished.extend(wait(pending).done)
+            raise failed(_count_stored(finished, count), e)
+    return _count_stored(finished, count)
+
+def _count_stored(futures:Iterable[Future], count:Callable[[R], int]) -> int:
+    """Sum count over the results of the futures that completed without an error"""
+    return sum(count(future.result()) for future in futures if not future.cancelled() and future.exception() is None)
@@ -1,5 +1,6 @@
-from typing import List, Optional
+from typing import BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple
 from neumai.SinkConnectors.SinkConnector import SinkConnector
+from neumai.SinkConnectors.SinkHelper import batched, upsert_concurrently
 from neumai.Shared.NeumSinkInfo import NeumSinkInfo
 from neumai.Shared.NeumVector  import NeumVector
 from neumai.Shared.NeumSearch import NeumSearchResult
@@ -9,9 +10,21 @@ from neumai.Shared.Exceptions import(
     SupabaseIndexInfoException,
     SupabaseQueryException
 )
-from pydantic import Field
+from pydantic import Field, PrivateAttr, confloat, conint
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
+import io
+import itertools
+import orjson
+import struct
+import time
+import numpy as np
 import vecs
 
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
 class SupabaseSink(SinkConnector):
     """
     Supabase Sink
@@ -21,16 +34,45 @@ class SupabaseSink(SinkConnector):
     Attributes:
     -----------
     database_connection : str
-        Connection string or details required to connect to the Supabase database.
+        Connection string or details required to connect to the Supabase database. When running many workers, point this at a PgBouncer (transaction pooling) URL so server connections are shared.
 
     collection_name : Optional[str]
         Optional name of the collection within Supabase where the data will be stored.
+
+    batch_size : int
+        Optional number of records sent in each upsert statement. Default is 500.
+
+    concurrency : int
+        Optional number of batches upserted in parallel. Each batch checks out its own connection from the client's pool, so keep this within the pool size. Default is 4.
+
+    bulk : Optional[bool]
+        Optional flag for initial loads into a new collection. Records are streamed with COPY instead of upserted, which is much faster but fails if an id already exists. Default is False.
+
+    stats_ttl_seconds : float
+        Optional number of seconds a collection's vector count is reused by info before being counted again, 0 disables caching. Default is 5.
+
+    exact_count : Optional[bool]
+        Optional flag to have info run an exact COUNT(*) instead of reading postgres' row estimate for the collection. Exact counts scan the whole table. Default is False.
     """
 
     database_connection: str = Field(..., description="Database connection for Supabase.")
 
     collection_name: Optional[str] = Field(None, description="Optional collection name.")
 
+    batch_size: conint(gt=0) = Field(500, description="Optional upsert batch size.")
+
+    concurrency: conint(gt=0) = Field(4, description="Optional number of concurrent upserts.")
+
+    bulk: Optional[bool] = Field(False, description="Optional bulk load flag.")
+
+    stats_ttl_seconds: confloat(ge=0) = Field(5.0, description="Optional time to live for cached vector counts.")
+
+    exact_count: Optional[bool] = Field(False, description="Optional exact count flag.")
+
+    _client: Optional[vecs.Client] = PrivateAttr(default=None)
+
+    _count_cache: Dict[str, Tuple[float, int]] = PrivateAttr(default_factory=dict)
+
     @property
     def sink_name(self) -> str:
         return 'SupabaseSink'
@@ -41,48 +83,125 @@ class SupabaseSink(SinkConnector):
 
     @property
     def optional_properties(self) -> List[str]:
-        return ['collection_name']
+        return ['collection_name', 'batch_size', 'concurrency', 'bulk', 'stats_ttl_seconds', 'exact_count']
+
+    def _vx(self) -> vecs.Client:
+        """vecs client, connected on first use and reused across calls"""
+        if self._client is None:
+            self._client = vecs.create_client(self.database_connection)
+        return self._client
+
+    def close(self) -> None:
+        """Disconnect the cached vecs client"""
+        if self._client is not None:
+            self._client.disconnect()
+            self._client = None
+        self._count_cache.clear()
 
     def validation(self) -> bool:
         """config_validation connector setup"""
-        import vecs
         try:
-            vx = vecs.create_client(self.database_connection)
+            # The client is reused, so check the connection with a round-trip rather than relying on connect
+            with self._vx().Session() as session:
+                session.execute(text("SELECT 1"))
         except Exception as e:
+            self.close()
             raise SupabaseConnectionException(f"Supabase connection couldn't be initialized. See exception: {e}")
         return True 
 
-    def store(self, pipeline_id: str, vectors_to_store:List[NeumVector], task_id:str = "") -> int:
-        database_connection = self.database_connection
-        vx = vecs.create_client(database_connection)
+    def store(self, pipeline_id: str, vectors_to_store:Iterable[NeumVector], task_id:str = "") -> int:
+        vx = self._vx()
         try:
             collection_name = self.collection_name
             if collection_name == None: collection_name = f"pipeline_{pipeline_id}"
-            dimensions = len(vectors_to_store[0].vector)
-            db = vx.get_or_create_collection(name=collection_name, dimension=dimensions)
-            to_upsert = []
-            for i in range(0, len(vectors_to_store)):
-                to_upsert.append((vectors_to_store[i].id, vectors_to_store[i].vector, vectors_to_store[i].metadata))
-
-            db.upsert(records=to_upsert)
+            # Peek at the first vector for the dimensions without materializing the input
+            vectors = iter(vectors_to_store)
+            first_vector = next(vectors, None)
+            if first_vector is None:
+                return 0
+            vectors = itertools.chain([first_vector], vectors)
+            db = vx.get_or_create_collection(name=collection_name, dimension=len(first_vector.vector))
+            if self.bulk:
+                vectors_stored = self._copy(vx=vx, collection_name=collection_name, vectors_to_store=vectors)
+            else:
+                vectors_stored = self._upsert(db=db, vectors_to_store=vectors)
+            self._count_cache.pop(collection_name, None)
+        except SupabaseInsertionException:
+            raise
         except Exception as e:
             raise SupabaseInsertionException(f"Supabase storing failed. Exception {e}")
+        return vectors_stored
+
+    def _upsert(self, db:vecs.Collection, vectors_to_store:Iterable[NeumVector]) -> int:
+        # psycopg releases the GIL while waiting on the network, so batches can be
+        # upserted from threads. Each upsert runs in its own session from the pool.
+        to_upsert = ((vector.id, vector.vector, vector.metadata) for vector in vectors_to_store)
+        return upsert_concurrently(
+            batched(to_upsert, self.batch_size),
+            upsert=lambda batch: self._upsert_batch(db, batch),
+            count=lambda vectors_stored: vectors_stored,
+            concurrency=self.concurrency,
+            failed=lambda vectors_stored, e: SupabaseInsertionException(f"Supabase storing failed after {vectors_stored} vectors were stored. Exception {e}"),
+        )
+
+    @retry(retry=retry_if_exception_type(OperationalError), wait=wait_exponential(multiplier=0.5, max=8), stop=stop_after_attempt(5), reraise=True)
+    def _upsert_batch(self, db:vecs.Collection, batch:tuple) -> int:
+        db.upsert(records=batch)
+        return len(batch)
+
+    def _table_name(self, collection_name:str) -> str:
+        """Quoted name of the table vecs keeps the collection in"""
+        return '"vecs"."{}"'.format(collection_name.replace('"', '""'))
+
+    def _copy(self, vx:vecs.Client, collection_name:str, vectors_to_store:Iterable[NeumVector]) -> int:
+        """Bulk load the collection table with binary COPY, skipping the ON CONFLICT upsert path"""
+        table = self._table_name(collection_name)
+        vectors_stored = 0
+        connection = vx.engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                for batch in batched(vectors_to_store, self.batch_size):
+                    cursor.copy_expert(f"COPY {table} (id, vec, metadata) FROM STDIN (FORMAT BINARY)", self._copy_buffer(batch))
+                    vectors_stored += len(batch)
+                # Refresh planner statistics once the load is done
+                cursor.execute(f"ANALYZE {table}")
+            connection.commit()
+        except:
+            connection.rollback()
+            raise
         finally:
-            vx.disconnect()
-        return len(vectors_to_store)
+            connection.close()
+        return vectors_stored
+
+    def _copy_buffer(self, vectors:Sequence[NeumVector]) -> BinaryIO:
+        """Encode vectors as a postgres binary COPY stream of (text id, vector, jsonb metadata) rows"""
+        # Convert the whole batch at once, numpy rows are stacked without boxing each value
+        batch_values = np.asarray([vector.vector for vector in vectors], dtype=">f4")
+        # pgvector binary format: int16 dimensions, int16 unused, float4 values
+        vector_header = struct.pack(">hh", batch_values.shape[1], 0)
+        buffer = io.BytesIO()
+        buffer.write(PGCOPY_HEADER)
+        for vector, values in zip(vectors, batch_values):
+            fields = (
+                str(vector.id).encode(),
+                vector_header + values.tobytes(),
+                # jsonb binary format: version byte followed by the json text
+                b"\x01" + orjson.dumps(vector.metadata, option=orjson.OPT_NON_STR_KEYS),
+            )
+            buffer.write(struct.pack(">h", len(fields)))
+            for field in fields:
+                buffer.write(struct.pack(">i", len(field)))
+                buffer.write(field)
+        buffer.write(PGCOPY_TRAILER)
+        buffer.seek(0)
+        return buffer
     
     def search(self, vector: List[float], number_of_results:int, pipeline_id:str) -> List:
-        database_connection = self.database_connection
-        vx = vecs.create_client(database_connection)
+        vx = self._vx()
         collection_name = self.collection_name
         if collection_name == None: collection_name = f"pipeline_{pipeline_id}"
         try:
             db = vx.get_collection(name=collection_name)
-        except:
-            raise SupabaseQueryException(f"Collection {collection_name} does not exist")
-        finally:
-            vx.disconnect()
-        try:
             results = db.query(
                 data=vector,
                 include_metadata=True,
@@ -90,31 +209,38 @@ class SupabaseSink(SinkConnector):
                 limit=number_of_results,
             )
         except Exception as e:
-            raise SupabaseQueryException(f"Error querying vectors from Supabase. Exception: {e}")
-        finally:
-            vx.disconnect()
-        matches = []
-        for result in results:
-            matches.append(NeumSearchResult(
-                id= str(result[0]),
-                metadata=result[2],
-                score=result[1]
-            ))
-        
-        return matches
+            raise SupabaseQueryException(f"Error querying vectors from collection {collection_name} in Supabase. Exception: {e}")
+
+        search_result = NeumSearchResult
+        return [search_result(id=str(result[0]), metadata=result[2], score=result[1]) for result in results]
     
     def info(self, pipeline_id: str) -> NeumSinkInfo:
-        database_connection = self.database_connection
-        vx = vecs.create_client(database_connection)
+        vx = self._vx()
         collection_name = self.collection_name
         if collection_name == None: collection_name = f"pipeline_{pipeline_id}"
+        # Counting is a full scan on large collections, reuse recent counts for polling callers
+        cached_count = self._count_cache.get(collection_name)
+        if cached_count is not None and time.monotonic() - cached_count[0] < self.stats_ttl_seconds:
+            return NeumSinkInfo(number_vectors_stored=cached_count[1])
         try:
-            db = vx.get_collection(name=collection_name)
+            vx.get_collection(name=collection_name)
         except:
             raise SupabaseIndexInfoException(f"Collection {collection_name} does not exist")
-        finally:
-            vx.disconnect()
-        
-        number_of_vectors = db.table.select('count(*)')[0].count
 
-        return NeumSinkInfo(number_vectors_stored=number_of_vectors)
\ No newline at end of file
+        try:
+            number_of_vectors = self._count_vectors(vx=vx, collection_name=collection_name)
+        except Exception as e:
+            raise SupabaseIndexInfoException(f"Error counting vectors in collection {collection_name}. Exception: {e}")
+        self._count_cache[collection_name] = (time.monotonic(), number_of_vectors)
+
+        return NeumSinkInfo(number_vectors_stored=number_of_vectors)
+
+    def _count_vectors(self, vx:vecs.Client, collection_name:str) -> int:
+        """Planner row estimate for the collection, exact COUNT(*) if requested or the table was never analyzed"""
+        table = self._table_name(collection_name)
+        with vx.Session() as session:
+            if not self.exact_count:
+                estimate = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}).scalar()
+                if estimate is not None and estimate >= 0:
+                    return estimate
+            return session.execute(text(f"SELECT count(*) FROM {table}")).scalar()
\ No newline at end of file
@@ -0,0 +1,169 @@
+import grpc
+import threading
+import time
+import numpy as np
+import orjson
+import pinecone
+import pytest
+from pydantic import ValidationError
+from pinecone.core.client.exceptions import ApiException
+from pinecone.exceptions import PineconeException, PineconeProtocolError
+from neumai.Shared.Exceptions import PineconeInsertionException
+from neumai.Shared.NeumVector import NeumVector
+from neumai.SinkConnectors.PineconeSink import PineconeSink, is_retryable_upsert_error
+
+class RpcError(grpc.RpcError):
+    def __init__(self, code:grpc.StatusCode) -> None:
+        self._code = code
+
+    def code(self) -> grpc.StatusCode:
+        return self._code
+
+class UpsertResponse:
+    def __init__(self, upserted_count:int) -> None:
+        self.upserted_count = upserted_count
+
+def grpc_client_error(code:grpc.StatusCode) -> PineconeException:
+    """Same shape as GRPCIndex._wrap_grpc_call: a PineconeException raised from the RpcError"""
+    try:
+        try:
+            raise RpcError(code)
+        except RpcError as e:
+            raise PineconeException("debug error string") from e
+    except PineconeException as e:
+        return e
+
+@pytest.mark.parametrize("code", [grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.DEADLINE_EXCEEDED])
+def test_grpc_transient_errors_are_retried(code):
+    assert is_retryable_upsert_error(grpc_client_error(code))
+
+def test_grpc_invalid_argument_is_not_retried():
+    assert not is_retryable_upsert_error(grpc_client_error(grpc.StatusCode.INVALID_ARGUMENT))
+
+def test_rest_dropped_connection_is_retried():
+    assert is_retryable_upsert_error(PineconeProtocolError("Failed to connect"))
+
+@pytest.mark.parametrize("status, retryable", [(429, True), (503, True), (400, False)])
+def test_rest_status_errors(status, retryable):
+    assert is_retryable_upsert_error(ApiException(status=status)) == retryable
+
+def test_upsert_batch_retries_transient_errors(monkeypatch):
+    monkeypatch.setattr(PineconeSink._upsert_batch.retry, "sleep", lambda seconds: None)
+    errors = [grpc_client_error(grpc.StatusCode.UNAVAILABLE), PineconeProtocolError("Failed to connect")]
+
+    class Index:
+        def upsert(self, vectors, namespace):
+            if errors:
+                raise errors.pop(0)
+            return len(vectors)
+
+    sink = PineconeSink(api_key="key", environment="environment", index="index")
+    assert sink._upsert_batch(Index(), [("id", [0.1], {})], "namespace") == 1
+
+@pytest.mark.parametrize("field", ["batch_size", "concurrency"])
+@pytest.mark.parametrize("value", [0, -1, None])
+def test_batching_fields_must_be_positive(field, value):
+    with pytest.raises(ValidationError):
+        PineconeSink(api_key="key", environment="environment", index="index", **{field: value})
+
+@pytest.mark.parametrize("value", [-1, None])
+def test_stats_ttl_must_not_be_negative(value):
+    with pytest.raises(ValidationError):
+        PineconeSink(api_key="key", environment="environment", index="index", stats_ttl_seconds=value)
+
+def test_store_reports_vectors_stored_before_a_failed_batch():
+    class Index(pinecone.Index):
+        def __init__(self) -> None:
+            self.calls = 0
+
+        def upsert(self, vectors, namespace):
+            self.calls += 1
+            if self.calls > 1:
+                raise ValueError("invalid vector")
+            return UpsertResponse(len(vectors))
+
+    sink = PineconeSink(api_key="key", environment="environment", index="index", batch_size=2, concurrency=1)
+    sink._idx = Index()
+    vectors = [NeumVector(id=str(i), vector=[0.1], metadata={}) for i in range(4)]
+    with pytest.raises(PineconeInsertionException) as exc_info:
+        sink.store(pipeline_id="pipeline", vectors_to_store=vectors)
+    assert str(exc_info.value) == "Failed to store in Pinecone after 2 vectors were stored. Exception - invalid vector"
+
+def test_store_counts_batches_that_finish_after_a_failed_batch():
+    running = threading.Event()
+
+    class Index(pinecone.Index):
+        def __init__(self) -> None:
+            self.upserted = []
+
+        def upsert(self, vectors, namespace):
+            self.upserted += [vector[0] for vector in vectors]
+            if vectors[0][0] == "0":
+                running.wait()
+                raise ValueError("invalid vector")
+            running.set()
+            time.sleep(0.1)
+            return UpsertResponse(len(vectors))
+
+    index = Index()
+    sink = PineconeSink(api_key="key", environment="environment", index="index", batch_size=1, concurrency=2)
+    sink._idx = index
+    vectors = [NeumVector(id=str(i), vector=[0.1], metadata={}) for i in range(4)]
+    with pytest.raises(PineconeInsertionException) as exc_info:
+        sink.store(pipeline_id="pipeline", vectors_to_store=vectors)
+    assert str(exc_info.value) == "Failed to store in Pinecone after 1 vectors were stored. Exception - invalid vector"
+    assert sorted(index.upserted) == ["0", "1"]
+
+def test_index_handle_is_built_once_across_threads(monkeypatch):
+    built = []
+
+    class Index:
+        def __init__(self, index_name) -> None:
+            time.sleep(0.05)
+            built.append(self)
+
+    monkeypatch.setattr(pinecone, "init", lambda api_key, environment: None)
+    monkeypatch.setattr(pinecone, "Index", Index)
+    sink = PineconeSink(api_key="key", environment="environment", index="index", use_grpc=False)
+    barrier = threading.Barrier(4)
+    handles = []
+
+    def get_index() -> None:
+        barrier.wait()
+        handles.append(sink._index)
+
+    threads = [threading.Thread(target=get_index) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(built) == 1
+    assert all(handle is built[0] for handle in handles)
+
+def test_rest_records_are_tuples_for_non_grpc_handles():
+    sink = PineconeSink(api_key="key", environment="environment", index="index")
+    vectors = [NeumVector(id="id", vector=[0.1, 0.2], metadata={"a": 1})]
+    assert list(sink._upsert_batches(vectors)) == [[("id", [0.1, 0.2], {"a": 1})]]
+
+    class Index:
+        def __init__(self) -> None:
+            self.vectors = []
+
+        def upsert(self, vectors, namespace):
+            self.vectors += vectors
+            return UpsertResponse(len(vectors))
+
+    index = Index()
+    sink._idx = index
+    assert sink.store(pipeline_id="pipeline", vectors_to_store=vectors) == 1
+    assert index.vectors == [("id", [0.1, 0.2], {"a": 1})]
+
+def test_rest_batches_are_split_by_json_size():
+    rng = np.random.default_rng(0)
+    sink = PineconeSink(api_key="key", environment="environment", index="index")
+    vectors = [NeumVector(id=str(i), vector=rng.random(1536).tolist(), metadata={"text": "chunk"}) for i in range(100)]
+    batches = list(sink._upsert_batches(vectors))
+    assert len(batches) > 1
+    assert sum(len(batch) for batch in batches) == 100
+    for batch in batches:
+        assert len(orjson.dumps({"vectors": [{"id": id, "values": values, "metadata": metadata} for id, values, metadata in batch]})) < 2_000_000
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+import struct
+from pydantic import ValidationError
+from neumai.Shared.NeumVector import NeumVector
+from neumai.SinkConnectors.SupabaseSink import PGCOPY_HEADER, PGCOPY_TRAILER, SupabaseSink
+
+class Session:
+    """Stands in for a vecs session, answering each statement with the next scripted scalar"""
+    def __init__(self, scalars:list) -> None:
+        self.scalars = scalars
+        self.statements = []
+
+    def __enter__(self) -> "Session":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+    def execute(self, statement, parameters=None) -> "Session":
+        self.statements.append(str(statement))
+        return self
+
+    def scalar(self):
+        return self.scalars.pop(0)
+
+class Collection:
+    def upsert(self, records) -> None:
+        pass
+
+class Client:
+    def __init__(self, scalars:list) -> None:
+        self.session = Session(scalars)
+
+    def Session(self) -> Session:
+        return self.session
+
+    def get_collection(self, name:str) -> Collection:
+        return Collection()
+
+    def get_or_create_collection(self, name:str, dimension:int) -> Collection:
+        return Collection()
+
+def sink_with_client(scalars:list, **kwargs) -> SupabaseSink:
+    sink = SupabaseSink(database_connection="postgresql://localhost/postgres", **kwargs)
+    sink._client = Client(scalars)
+    return sink
+
+@pytest.mark.parametrize("field", ["batch_size", "concurrency"])
+@pytest.mark.parametrize("value", [0, -1, None])
+def test_batching_fields_must_be_positive(field, value):
+    with pytest.raises(ValidationError):
+        SupabaseSink(database_connection="postgresql://localhost/postgres", **{field: value})
+
+@pytest.mark.parametrize("value", [-1, None])
+def test_stats_ttl_must_not_be_negative(value):
+    with pytest.raises(ValidationError):
+        SupabaseSink(database_connection="postgresql://localhost/postgres", stats_ttl_seconds=value)
+
+@pytest.mark.parametrize("values", [[1.0, -2.5], np.array([1.0, -2.5])])
+def test_copy_buffer_encodes_binary_copy_rows(values):
+    sink = SupabaseSink(database_connection="postgresql://localhost/postgres")
+    vectors = [NeumVector(id="a", vector=values, metadata={"k": 1}), NeumVector(id=7, vector=[0.5, 0.0], metadata={})]
+
+    def row(id:bytes, values:list, metadata:bytes) -> bytes:
+        vector = struct.pack(">hh", len(values), 0) + struct.pack(f">{len(values)}f", *values)
+        jsonb = b"\x01" + metadata
+        return (struct.pack(">h", 3)
+            + struct.pack(">i", len(id)) + id
+            + struct.pack(">i", len(vector)) + vector
+            + struct.pack(">i", len(jsonb)) + jsonb)
+
+    expected = PGCOPY_HEADER + row(b"a", [1.0, -2.5], b'{"k":1}') + row(b"7", [0.5, 0.0], b"{}") + PGCOPY_TRAILER
+    assert sink._copy_buffer(vectors).read() == expected
+
+def test_copy_header_and_trailer():
+    assert PGCOPY_HEADER == b"PGCOPY\n\xff\r\n\x00" + b"\x00" * 8
+    assert PGCOPY_TRAILER == b"\xff\xff"
+
+def test_count_uses_the_row_estimate():
+    sink = sink_with_client([42])
+    assert sink._count_vectors(vx=sink._client, collection_name="collection") == 42
+    assert len(sink._client.session.statements) == 1
+    assert "reltuples" in sink._client.session.statements[0]
+
+@pytest.mark.parametrize("estimate", [-1, None])
+def test_count_falls_back_to_count_without_an_estimate(estimate):
+    sink = sink_with_client([estimate, 3])
+    assert sink._count_vectors(vx=sink._client, collection_name="collection") == 3
+    assert 'SELECT count(*) FROM "vecs"."collection"' in sink._client.session.statements[1]
+
+def test_exact_count_skips_the_estimate():
+    sink = sink_with_client([3], exact_count=True)
+    assert sink._count_vectors(vx=sink._client, collection_name="collection") == 3
+    assert sink._client.session.statements == ['SELECT count(*) FROM "vecs"."collection"']
+
+def test_info_reuses_the_count_until_store():
+    sink = sink_with_client([10, 12], stats_ttl_seconds=60)
+    assert sink.info(pipeline_id="pipeline").number_vectors_stored == 10
+    assert sink.info(pipeline_id="pipeline").number_vectors_stored == 10
+    assert len(sink._client.session.statements) == 1
+
+    sink.store(pipeline_id="pipeline", vectors_to_store=[NeumVector(id="a", vector=[0.1], metadata={})])
+    assert sink.info(pipeline_id="pipeline").number_vectors_stored == 12
+    assert len(sink._client.session.statements) == 2
+
+def test_info_counts_every_call_without_a_ttl():
+    sink = sink_with_client([10, 12], stats_ttl_seconds=0)
+    assert sink.info(pipeline_id="pipeline").number_vectors_stored == 10
+    assert sink.info(pipeline_id="pipeline").number_vectors_stored == 12